@@ -1,9 +1,13 @@
 import pandas as pd
 import pandas_datareader as pdr
 import sqlite3
+import os
+import gc
+import shutil
 from datetime import timedelta
 from datetime import datetime as dt
 import dataReader as dr
+import dataLogger as dl
 
 def setupDB():
     # Setup local SQLite database (if not exist) and open the connection
@@ -64,11 +68,102 @@ def setupDB():
         Adj_close REAL NOT NULL,
         Ticker TEXT NOT NULL,
         PRIMARY KEY(Date, Ticker));''')
+
+    setupAudit(con)
     
     #Close the connection
     con.close()
     print("Database setup: Done.")
 
+def setupAudit(con):
+    '''
+    Create the audit table of the cleaning corrections, if not exist in an older database.
+
+    Parameter
+    con (sqlite3.Connection):
+        The connection of the local database.
+    '''
+    cur = con.cursor()
+    cur.execute('''CREATE TABLE IF NOT EXISTS audit(
+        ID_audit INTEGER PRIMARY KEY AUTOINCREMENT,
+        Step TEXT NOT NULL,
+        From_value TEXT NOT NULL,
+        To_value TEXT NOT NULL,
+        ISIN TEXT,
+        Date DATETIME,
+        Update_time DATETIME NOT NULL DEFAULT (datetime(CURRENT_TIMESTAMP, 'localtime')));''')
+    con.commit()
+
+def marketsDownloader(start, end):
+    '''
+    Download the DAX prices as markets data and trade date reference.
+
+    Parameters
+    start (str):
+        The start date, "YYYY-MM-DD".
+    end (str):
+        The end date, "YYYY-MM-DD".
+
+    Returns
+    markets (pandas.DataFrame):
+        DAX prices indexed with datetime.
+    '''
+    markets = pdr.DataReader("^GDAXI", 'yahoo', start, end)
+    markets.rename(columns = {"Adj Close": "Adj_close"}, inplace = True)
+    markets["Ticker"] = "DAX"
+    return markets
+
+def staRecords(con):
+    '''
+    Manually update sta_records from the positions table.
+
+    Parameter
+    con (sqlite3.Connection):
+        The connection of the local database.
+    '''
+    cur = con.cursor()
+    cur.execute('DROP TABLE IF EXISTS sta_records;')
+    cur.execute('''CREATE TABLE sta_records AS 
+        SELECT Date,
+            COUNT(DISTINCT Holder) AS num_Holder,
+            COUNT(DISTINCT ISIN) AS num_ISIN,
+            SUM(Covering) AS num_Coverring,
+            SUM(Increase) AS num_Increase
+        FROM positions WHERE Position > 0 GROUP BY Date;''')
+
+def stocksCollector(ISINs, markets, start, end):
+    '''
+    Map ISINs to tickers and names, download their prices and make up the stocks.
+
+    Parameters
+    ISINs (list):
+        A list of ISIN.
+    markets (pandas.DataFrame):
+        Markets data as trade date reference.
+    start (str):
+        The start date of the prices, "YYYY-MM-DD".
+    end (str):
+        The end date of the prices, "YYYY-MM-DD".
+
+    Returns
+    issuers (pandas.DataFrame)
+    stocks (pandas.DataFrame)
+    '''
+    # issuers
+    tickers, names = dr.mapISINtoTicker(ISINs)
+    issuers = pd.DataFrame({"ISIN": ISINs, "Ticker": tickers, "Name": names})
+
+    # prices
+    tickers = [ticker for ticker in issuers["Ticker"].values if ticker is not None]
+    prices, errors = dr.pricesDownloader(tickers, start, end)
+    # Update issuers
+    for error in errors:
+        issuers.loc[issuers["Ticker"] == error, "Ticker"] = None
+
+    # stocks
+    stocks = dr.stocksMakeup(prices, markets, initial = True)
+    return issuers, stocks
+
 def initialInpute(end):
     '''
     Initially collect, clean data and input to MySQL database.
@@ -79,7 +174,9 @@ def initialInpute(end):
     '''
     
     start = "2012-01-01"
+    dl.setupLogger()
     con = sqlite3.connect('ssDB.db')
+    setupAudit(con)
 
     # 1. records, holders, positions: Doweload csv file and clean the records
     filename = dr.recordsDownloader(start, end)
@@ -89,46 +186,153 @@ def initialInpute(end):
     records.to_sql(name = "records", con = con, if_exists = "append", index = False)
     positions.to_sql(name = "positions", con = con, if_exists = "append", index = False)
     holders.to_sql(name = "holders", con = con, if_exists = "append", index = False)
+    dl.popAudit().to_sql(name = "audit", con = con, if_exists = "append", index = False)
 
-    # 2. issuers: Get ISINs from records and map to tickers and names
+    # 2. issuers, stocks and markets: Map ISINs to tickers and names, doweload stock and DAX prices
     ISINs = records["ISIN"].sort_values().unique()
-    tickers, names = dr.mapISINtoTicker(ISINs)
-    issuers = pd.DataFrame({"ISIN": ISINs, "Ticker": tickers, "Name": names})
+    markets = marketsDownloader(start, end)
+    issuers, stocks = stocksCollector(ISINs, markets, start, end)
 
-    # 3. stocks and markets: Doweload stock and DAX prices
-    # prices
-    tickers = [ticker for ticker in issuers["Ticker"].values if ticker is not None]
-    prices, errors = dr.pricesDownloader(tickers, start, end)
-    # Update issuers
-    for error in errors:
-        issuers.loc[issuers["Ticker"] == error, "Ticker"] = None 
     issuers.to_sql(name = "issuers", con = con, if_exists = "append", index = False)
-
-    # DAX
-    markets = pdr.DataReader("^GDAXI", 'yahoo', start, end)
-    markets.rename(columns = {"Adj Close": "Adj_close"}, inplace = True)
-    markets["Ticker"] = "DAX"
-    # stocks
-    stocks = dr.stocksMakeup(prices, markets, initial = True)
-
     stocks.to_sql(name = "stocks", con = con, if_exists = "append", index = False)
     markets.to_sql(name = "markets", con = con, if_exists = "append", index = True)
 
     # Manually update sta_view
-    cur = con.cursor()
-    cur.execute('DROP TABLE IF EXISTS sta_records;')
-    cur.execute('''CREATE TABLE sta_records AS 
-        SELECT Date,
-            COUNT(DISTINCT Holder) AS num_Holder,
-            COUNT(DISTINCT ISIN) AS num_ISIN,
-            SUM(Covering) AS num_Coverring,
-            SUM(Increase) AS num_Increase
-        FROM positions WHERE Position > 0 GROUP BY Date;''')
+    staRecords(con)
 
     #Close the connection
     con.close()
     print("Initialized to {}: Done.".format(end))
 
+SINKS = ["sqlite", "parquet"]
+# Rows written at once by toSink
+SLICE_ROWS = 10000
+# MB of the budget kept for the slices written by toSink and the SQLite page cache
+SINK_BUDGET = 4
+
+def toSink(df, name, con, part, sink = "sqlite", index = False):
+    '''
+    Write one partition of a table to SQLite or to a Parquet dataset, slice by slice.
+
+    Parameters
+    df (pandas.DataFrame):
+        The partition to write.
+    name (str):
+        The table name.
+    con (sqlite3.Connection):
+        The SQLite connection, only used for the "sqlite" sink.
+    part (int):
+        The partition number, used as Parquet file name.
+    sink (str):
+        "sqlite" for the local database, "parquet" for the "ssDB_parquet" directory.
+    index (boolean):
+        Write the index as a column.
+    '''
+    if sink not in SINKS:
+        raise ValueError("Unknown sink '{}'".format(sink))
+    if df.empty:
+        return
+
+    if sink == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        path = os.path.join("ssDB_parquet", name)
+        os.makedirs(path, exist_ok = True)
+        filename = os.path.join(path, "part-{:05d}.parquet".format(part))
+    writer = None
+
+    # Both to_sql and to_parquet convert the whole frame before writing
+    try:
+        for i in range(0, len(df), SLICE_ROWS):
+            chunk = df.iloc[i:i + SLICE_ROWS]
+            if sink == "sqlite":
+                chunk.to_sql(name = name, con = con, if_exists = "append", index = index)
+                continue
+
+            # Text columns as string, so a column of only None is not written as null type
+            chunk = chunk.astype({col: "string" for col in chunk.columns if chunk[col].dtype == object})
+            table = pa.Table.from_pandas(chunk, schema = None if writer is None else writer.schema,
+                                         preserve_index = index)
+            if writer is None:
+                writer = pq.ParquetWriter(filename, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+def partitionedInpute(end, budget = 512, sink = "sqlite"):
+    '''
+    Initially collect, clean data and input to database partition by partition of ISINs.
+    Positions and stocks of one partition are written before the next one is made up.
+
+    The budget covers the records and DAX prices held during the whole rebuild,
+    the positions and stocks of one partition, and the slices written by toSink.
+
+    Parameter
+    end (str):
+        Initialize the database to the end time, "YYYY-MM-DD".
+    budget (int):
+        Memory budget of the rebuild in MB.
+    sink (str):
+        "sqlite" for the local database, "parquet" for the "ssDB_parquet" directory.
+    '''
+    if sink not in SINKS:
+        raise ValueError("Unknown sink '{}'".format(sink))
+    if budget <= SINK_BUDGET:
+        raise ValueError("Budget must be larger than {} MB".format(SINK_BUDGET))
+
+    start = "2012-01-01"
+    dl.setupLogger()
+
+    if sink == "parquet":
+        # Drop part files of an earlier build
+        for name in ["records", "holders", "audit", "markets", "positions", "issuers", "stocks"]:
+            shutil.rmtree(os.path.join("ssDB_parquet", name), ignore_errors = True)
+        con = None
+    else:
+        con = sqlite3.connect('ssDB.db')
+        setupAudit(con)
+
+    try:
+        # 1. records, holders: Doweload csv file and clean the records
+        filename = dr.recordsDownloader(start, end)
+        records, holders = dr.initialClean(filename)
+
+        toSink(records, "records", con, 0, sink)
+        toSink(holders, "holders", con, 0, sink)
+        toSink(dl.popAudit(), "audit", con, 0, sink)
+        del holders
+
+        # DAX as trade date reference for all partitions
+        markets = marketsDownloader(start, end)
+        toSink(markets, "markets", con, 0, sink, index = True)
+
+        # 2. positions, issuers, stocks: One partition of ISINs at a time
+        partitions = dr.isinPartitions(records, end, budget - SINK_BUDGET, markets)
+        for part, ISINs in enumerate(partitions):
+            # positions
+            positions = dr.positionsMakeup(records.loc[records["ISIN"].isin(ISINs)], end, initial = True)
+            toSink(positions, "positions", con, part, sink)
+            del positions
+
+            # issuers and stocks
+            issuers, stocks = stocksCollector(ISINs, markets, start, end)
+            toSink(issuers, "issuers", con, part, sink)
+            toSink(stocks, "stocks", con, part, sink)
+            del issuers, stocks
+            gc.collect()
+
+        # Manually update sta_view, only the SQLite sink can aggregate without loading positions
+        if sink == "sqlite":
+            staRecords(con)
+    finally:
+        #Close the connection
+        if con is not None:
+            con.close()
+
+    print("Initialized to {} in {} partition(s): Done.".format(end, len(partitions)))
+
 def updatedInpute(end):
     '''
     Updated collect, clean data and input to MySQL database.
@@ -138,7 +342,9 @@ def updatedInpute(end):
         Initialize the database to the end time, "YYYY-MM-DD".
     '''
     
+    dl.setupLogger()
     con = sqlite3.connect('ssDB.db')
+    setupAudit(con)
     # Get start and tail
     tail = pd.to_datetime(pd.read_sql_query("SELECT MAX(Date) AS Date FROM positions", con = con)["Date"][0],  format = "%Y-%m-%d")
     start = dt.strftime(tail + timedelta(days = 1), "%Y-%m-%d")
@@ -167,6 +373,7 @@ def updatedInpute(end):
     records.to_sql(name = "records", con = con, if_exists = "append", index = False)
     positions.to_sql(name = "positions", con = con, if_exists = "append", index = False)
     holders.to_sql(name = "holders", con = con, if_exists = "append", index = False)
+    dl.popAudit().to_sql(name = "audit", con = con, if_exists = "append", index = False)
 
     # 2. Update issuers: Get ISINs from records and map to tickers and names
     ISINs = records["ISIN"].sort_values().unique()
@@ -187,40 +394,19 @@ def updatedInpute(end):
 
     # 4. stocks for new ISINs: Doweload stock and DAX prices
     if len(ISINs) > 0:
-        # new issuers
-        tickers, names = dr.mapISINtoTicker(ISINs)
-        issuers = pd.DataFrame({"ISIN": ISINs, "Ticker": tickers, "Name": names})
-
-        # prices
-        tickers = [ticker for ticker in issuers["Ticker"].values if ticker is not None]
-        prices, errors = dr.pricesDownloader(tickers, "2012-01-01", end)
-        # Update issuers
-        for error in errors:
-            issuers.loc[issuers["Ticker"] == error, "Ticker"] = None
-        issuers.to_sql(name = "issuers", con = con, if_exists = "append", index = False)
+        markets = marketsDownloader("2012-01-01", end)
+        issuers, stocks_new = stocksCollector(ISINs, markets, "2012-01-01", end)
 
-        # stocks
-        markets = pdr.DataReader("^GDAXI", 'yahoo', "2012-01-01", end)
-        stocks_new = dr.stocksMakeup(prices, markets, initial = True)
+        issuers.to_sql(name = "issuers", con = con, if_exists = "append", index = False)
         stocks_new.to_sql(name = "stocks", con = con, if_exists = "append", index = False)
     
     # 5. Update markets
-    markets = pdr.DataReader("^GDAXI", 'yahoo', start, end)
-    markets.rename(columns = {"Adj Close": "Adj_close"}, inplace = True)
-    markets["Ticker"] = "DAX"
+    markets = marketsDownloader(start, end)
 
     markets.to_sql(name = "markets", con = con, if_exists = "append", index = True)
     
     # Manually update sta_view
-    cur = con.cursor()
-    cur.execute('DROP TABLE IF EXISTS sta_records;')
-    cur.execute('''CREATE TABLE sta_records AS 
-        SELECT Date,
-            COUNT(DISTINCT Holder) AS num_Holder,
-            COUNT(DISTINCT ISIN) AS num_ISIN,
-            SUM(Covering) AS num_Coverring,
-            SUM(Increase) AS num_Increase
-        FROM positions WHERE Position > 0 GROUP BY Date;''')
+    staRecords(con)
 
     #Close the connection
     con.close()
@@ -0,0 +1,106 @@
+import logging
+import logging.handlers
+import queue
+import atexit
+import pandas as pd
+
+logger = logging.getLogger("shortsell")
+_listener = None
+_audits = []
+
+def setupLogger(filename = "logfile", maxBytes = 10 * 1024 * 1024, backupCount = 5):
+    '''
+    Setup the non-blocking logger: records are put into a queue and written
+    to a rotating log file by a background listener thread.
+    Called by the entry points in dataInput, nothing is logged to file before.
+
+    Parameters
+    filename (str):
+        The name of the log file.
+    maxBytes (int):
+        Rotate the log file when it reaches this size.
+    backupCount (int):
+        Number of rotated log files to keep.
+
+    Returns
+    logger (logging.Logger)
+
+    '''
+    global _listener
+
+    # Stop the old listener and drop its handler before setting up the new one
+    stopLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    handler = logging.handlers.RotatingFileHandler(filename, maxBytes = maxBytes, backupCount = backupCount)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(funcName)s: %(message)s"))
+
+    q = queue.Queue(-1)
+    _listener = logging.handlers.QueueListener(q, handler)
+    _listener.start()
+    atexit.register(stopLogger)
+
+    logger.addHandler(logging.handlers.QueueHandler(q))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    return logger
+
+def stopLogger():
+    '''
+    Flush the queued log records and stop the listener thread.
+    '''
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+        atexit.unregister(stopLogger)
+
+def audit(step, old, new, ISIN = None, Date = None):
+    '''
+    Buffer the cleaning-audit records of one cleaning step.
+
+    Parameters
+    step (str):
+        The cleaning step, e.g. "Position" or "Holder".
+    old (array-like):
+        The values before cleaning.
+    new (array-like):
+        The values after cleaning.
+    ISIN (array-like):
+        The ISINs of the cleaned rows, if any.
+    Date (array-like):
+        The dates of the cleaned rows, if any.
+
+    '''
+    records = pd.DataFrame({"Step": step,
+                            "From_value": pd.Series(old, dtype = "str").values,
+                            "To_value": pd.Series(new, dtype = "str").values,
+                            "ISIN": None if ISIN is None else pd.Series(ISIN).values,
+                            "Date": None if Date is None else pd.Series(Date).values})
+    if records.empty:
+        return
+
+    _audits.append(records)
+    # Log the cleaning function instead of audit
+    logger.info("%d correction(s) of %s", len(records), step, stacklevel = 2)
+
+def popAudit():
+    '''
+    Return the buffered cleaning-audit records and clear the buffer.
+
+    Returns
+    audits (pandas.DataFrame):
+        Columns "Step", "From_value", "To_value", "ISIN", "Date".
+
+    '''
+    if not _audits:
+        return pd.DataFrame(columns = ["Step", "From_value", "To_value", "ISIN", "Date"])
+
+    audits = pd.concat(_audits, ignore_index = True)
+    _audits.clear()
+    return audits
@@ -7,6 +7,7 @@ import requests
 from selenium import webdriver
 import time
 import os
+import dataLogger as dl
 
 def recordsDownloader(start, end):
     '''
@@ -56,10 +57,7 @@ def recordsDownloader(start, end):
     downloaded = max([f for f in os.listdir('./')], key=os.path.getctime)
     os.rename(src = downloaded, dst = filename)
     
-    # Update logging
-    logging = "=" * 50 + "\n" + str(dt.now()) + ": Download CSV file '{}'\n".format(filename) + "=" * 50 + "\n\n"
-    with open("logfile", "a") as f:
-        f.write(logging)
+    dl.logger.info("Download CSV file '%s'", filename)
 
     return filename
 
@@ -79,7 +77,7 @@ def initialClean(csvName):
 
     # Read data from csv
     df = pd.read_csv(csvName)
-    logging = "=" * 50 + "\n" + str(dt.now()) + ": Start Initial Cleaning\n"
+    dl.logger.info("Start Initial Cleaning")
     # Rename the columns
     col_names = {"Positionsinhaber": "Holder",
                 "Emittent": "Issuer",
@@ -94,59 +92,43 @@ def initialClean(csvName):
     df["Holder"] = df["Holder"].map(unidecode)
 
     # 1. Typo of "Position": missing percentage mark %
-    if sum(df["Position"] > 50) > 0:
-        logging += '\n## Clean typo of "Position": missing percentage mark "%":\n'
-
-    for i in range(sum(df["Position"] > 50)):
-        logging += "\nFrom: " + str(df.loc[df["Position"] > 50, "Position"].values[i]) +\
-            " | " + str(df.loc[df["Position"] > 50, "ISIN"].values[i]) +\
-            " | " + str(df.loc[df["Position"] > 50, "Date"].values[i]) +\
-            "\nTo:   " + str(df.loc[df["Position"] > 50, "Position"].values[i] / 100) + "\n"
-
-    df.loc[df["Position"] > 50, "Position"] /= 100
+    mask = df["Position"] > 50
+    dl.audit("Position", df.loc[mask, "Position"], df.loc[mask, "Position"] / 100,
+             df.loc[mask, "ISIN"], df.loc[mask, "Date"])
+    df.loc[mask, "Position"] /= 100
 
     # 2. Typo of "Holder": upper and lower case, comma, dot, space
     org_name = df["Holder"].sort_values().unique()
     clr_name = [name.lower().replace(",", "").replace(".", "").replace(" ", "") for name in org_name]
     df_name = pd.DataFrame({"org_name": org_name,
                             "clr_name": clr_name,
-                            "count": [sum(df["Holder"] == name) for name in org_name],
+                            "count": df["Holder"].value_counts()[org_name].values,
                             "cut_name": [name[0:5] for name in clr_name]
                             }, dtype = 'str')
     df_name["count"] = pd.to_numeric(df_name["count"])
 
-    mask = [sum(df_name["clr_name"] == name) > 1 for name in df_name["clr_name"]]
+    mask = df_name["clr_name"].duplicated(keep = False)
     tmp = df_name.loc[mask, :].copy()
 
-    for name in tmp["clr_name"].unique():
-        maxc = max(tmp.loc[tmp["clr_name"] == name, "count"])
-        new_name = tmp.loc[(tmp["clr_name"] == name) & (tmp["count"] == maxc), "org_name"].values[0]
-        tmp.loc[tmp["clr_name"] == name, "new_name"] = new_name
-    if tmp.size > 0:
-        logging += '\n## Clean typo of "Holder": upper and lower case, comma, dot, space:\n'
-
-    for i in tmp.index:
-        if not(tmp.loc[i, "org_name"] is tmp.loc[i, "new_name"]):
-            logging += "\nFrom: {}\nto:   {}\n".format(tmp.loc[i, "org_name"], tmp.loc[i, "new_name"])
-        df.loc[df["Holder"] == tmp.loc[i, "org_name"], "Holder"] = tmp.loc[i, "new_name"]
+    # Use the first name with the most disclosures of each group, stable sort keeps the name order
+    tmp = tmp.sort_values("count", ascending = False, kind = "mergesort")
+    tmp["new_name"] = tmp.groupby("clr_name")["org_name"].transform("first")
+
+    tmp = tmp.loc[tmp["org_name"] != tmp["new_name"]]
+    dl.audit("Holder_case", tmp["org_name"], tmp["new_name"])
+    df["Holder"] = df["Holder"].map(dict(zip(tmp["org_name"], tmp["new_name"]))).fillna(df["Holder"])
     
     # 3. Typo of "Holder": similar name (first 5 letter) with only 1 disclosure
-    mask = [name in df_name.loc[df_name["count"] == 1]["cut_name"].unique() and sum(df_name["cut_name"] == name) > 1 for name in df_name["cut_name"]]
+    mask = df_name["cut_name"].isin(df_name.loc[df_name["count"] == 1, "cut_name"]) & df_name["cut_name"].duplicated(keep = False)
     tmp = df_name.loc[mask, :].copy()
 
-    for name in tmp["cut_name"].unique():
-        maxc = max(tmp.loc[tmp["cut_name"] == name, "count"])
-        new_name = tmp.loc[(tmp["cut_name"] == name) & (tmp["count"] == maxc), "org_name"].values[0]
-        tmp.loc[tmp["cut_name"] == name, "new_name"] = new_name
+    # Use the first name with the most disclosures of each group, stable sort keeps the name order
+    tmp = tmp.sort_values("count", ascending = False, kind = "mergesort")
+    tmp["new_name"] = tmp.groupby("cut_name")["org_name"].transform("first")
 
-    if tmp.size > 0:
-        logging += '\n## Clean typo of "Holder": similar name:\n'
-
-    for i in tmp.index:
-        if not(tmp.loc[i, "org_name"] is tmp.loc[i, "new_name"]):
-            # print("From: {}\nto:   {}\n".format(tmp.loc[i, "org_name"], tmp.loc[i, "new_name"]))
-            logging += "\nFrom: {}\nto:   {}\n".format(tmp.loc[i, "org_name"], tmp.loc[i, "new_name"])
-        df.loc[df["Holder"] == tmp.loc[i, "org_name"], "Holder"] = tmp.loc[i, "new_name"]
+    tmp = tmp.loc[tmp["org_name"] != tmp["new_name"]]
+    dl.audit("Holder_similar", tmp["org_name"], tmp["new_name"])
+    df["Holder"] = df["Holder"].map(dict(zip(tmp["org_name"], tmp["new_name"]))).fillna(df["Holder"])
 
     # 4. Drop duplicated rows
     df.drop_duplicates(keep = "first", inplace = True)
@@ -161,10 +143,7 @@ def initialClean(csvName):
                             "cut_name": [name[0:5] for name in clr_name]
                             }, dtype = 'str')
     
-    # Update logging
-    logging += "\n" + str(dt.now()) + ": End Initial Cleaning\n" + "=" * 50 + "\n\n"
-    with open("logfile", "a") as f:
-        f.write(logging)
+    dl.logger.info("End Initial Cleaning")
 
     return df, df_ref
 
@@ -185,7 +164,7 @@ def updatedClean(csvName, df_ref):
     '''
     # Read data from csv
     df = pd.read_csv(csvName)
-    logging = "=" * 50 + "\n" + str(dt.now()) + ": Start Updated Cleaning\n"
+    dl.logger.info("Start Updated Cleaning")
 
     # Rename the columns
     col_names = {"Positionsinhaber": "Holder",
@@ -201,30 +180,21 @@ def updatedClean(csvName, df_ref):
     df["Holder"] = df["Holder"].map(unidecode)
 
     # 1. Typo of "Position": missing percentage mark %
-    if sum(df["Position"] > 50) > 0:
-        logging += '\n## Clean typo of "Position": missing percentage mark "%":\n'
-
-        for i in range(sum(df["Position"] > 50)):
-            logging += "\nFrom: " + str(df.loc[df["Position"] > 50, "Position"].values[i]) +\
-                " | " + str(df.loc[df["Position"] > 50, "ISIN"].values[i]) +\
-                " | " + str(df.loc[df["Position"] > 50, "Date"].values[i]) +\
-                "\nTo:   " + str(df.loc[df["Position"] > 50, "Position"].values[i] / 100) + "\n"
-
-        df.loc[df["Position"] > 50, "Position"] /= 100
+    mask = df["Position"] > 50
+    dl.audit("Position", df.loc[mask, "Position"], df.loc[mask, "Position"] / 100,
+             df.loc[mask, "ISIN"], df.loc[mask, "Date"])
+    df.loc[mask, "Position"] /= 100
 
     # 2. Check typo of "Holder"
-    mask = [not name in df_ref["org_name"].values for name in df["Holder"]]
-    if sum(mask) == 0:
+    mask = ~df["Holder"].isin(df_ref["org_name"])
+    if not mask.any():
         # No new Holder, return data and keep reference
         # Drop duplicated rows
         df.drop_duplicates(keep = "first", inplace = True)
         df.sort_values("Date", inplace = True)
         df.reset_index(drop = True, inplace = True)
 
-        # Update logging
-        logging += "\n" + str(dt.now()) + ": End Updated Cleaning\n" + "=" * 50 + "\n\n"
-        with open("logfile", "a") as f:
-            f.write(logging)
+        dl.logger.info("End Updated Cleaning")
 
         return df, pd.DataFrame()
 
@@ -236,16 +206,14 @@ def updatedClean(csvName, df_ref):
                             "cut_name": [name[0:5] for name in clr_name]
                             }, dtype = 'str')
 
-    mask = [name in df_ref["clr_name"].values for name in new_ref["clr_name"]]
-    if sum(mask) > 0:
-        logging += '\n## Clean typo of "Holder": upper and lower case, comma, dot, space:\n'
-        for i in new_ref.loc[mask].index:
-            if new_ref.loc[i, "clr_name"] in df_ref["clr_name"].values:
-                name = df_ref.loc[df_ref["clr_name"] == new_ref.loc[i, "clr_name"], "org_name"].values[0]
-                df.loc[df["Holder"] == new_ref.loc[i, "org_name"], "Holder"] = name
-                logging += "\nFrom: {}\nto:   {}\n".format(new_ref.loc[i, "org_name"], name)
+    # Map to the first reference name with the same clean name
+    ref_name = df_ref.drop_duplicates("clr_name").set_index("clr_name")["org_name"]
+    tmp = new_ref.loc[new_ref["clr_name"].isin(ref_name.index)]
+    names = tmp["clr_name"].map(ref_name)
+    dl.audit("Holder_case", tmp["org_name"], names)
+    df["Holder"] = df["Holder"].map(dict(zip(tmp["org_name"], names))).fillna(df["Holder"])
     
-    mask = [not name in df_ref["clr_name"].values for name in new_ref["clr_name"]]
+    mask = ~new_ref["clr_name"].isin(df_ref["clr_name"])
     new_ref = new_ref.loc[mask]
     new_ref.reset_index(drop = True, inplace = True)
         
@@ -254,10 +222,7 @@ def updatedClean(csvName, df_ref):
     df.sort_values("Date", inplace = True)
     df.reset_index(drop = True, inplace = True)
 
-    # Update logging
-    logging += "\n" + str(dt.now()) + ": End Updated Cleaning\n" + "=" * 50 + "\n\n"
-    with open("logfile", "a") as f:
-        f.write(logging)
+    dl.logger.info("End Updated Cleaning")
 
     return df, new_ref
 
@@ -308,11 +273,7 @@ def mapISINtoTicker(ISIN):
             for result in response.json()]
 
     num_none = sum([ticker is None for ticker in tickers])
-    # Update logging
-    logging = "=" * 50 + "\n" + str(dt.now()) + ": {} ISIN(s) find no tickers or names from FIGI API.\n".format(num_none) 
-    logging += "=" * 50 + "\n\n"
-    with open("logfile", "a") as f:
-        f.write(logging)
+    dl.logger.info("%d ISIN(s) find no tickers or names from FIGI API.", num_none)
     
     return tickers, names
 
@@ -350,10 +311,7 @@ def pricesDownloader(tickers, start, end):
     
     prices.rename(columns = {"Adj Close": "Adj_close"}, inplace = True)
 
-    # Update logging
-    logging = "=" * 50 + "\n" + str(dt.now()) + ": Download stock prices from Yahoo.\n" + "=" * 50 + "\n\n"
-    with open("logfile", "a") as f:
-        f.write(logging)
+    dl.logger.info("Download stock prices from Yahoo, %d error(s).", len(errors))
     
     return prices, errors
 
@@ -412,7 +370,67 @@ def positionsMakeup(records, end, initial = False):
     # Drop the first day for update purpose
     positions = positions.loc[positions["Date"] > start].reset_index(drop = True)
     return positions
-        
+
+def isinPartitions(records, end, budget = 512, markets = None):
+    '''
+    Split the ISINs of the records into partitions which fit into a memory budget together with
+    the records and markets held during the whole rebuild.
+
+    Parameters
+    records (pandas.DataFrame):
+        Cleaned short position records from CSV file.
+    end (str):
+        Make up to the end date, "YYYY-MM-DD".
+    budget (int):
+        Memory budget of the rebuild in MB.
+    markets (pandas.DataFrame):
+        Markets data as trade date reference, the stocks of every ISIN are made up to it.
+
+    Return
+    partitions (list):
+        A list of ISIN lists, one list per partition.
+
+    '''
+    if records.empty:
+        return []
+
+    # Records and markets are held during the whole rebuild
+    fixed = records.memory_usage(deep = True).sum()
+    trade_days = 0
+    if markets is not None:
+        fixed += markets.memory_usage(deep = True).sum()
+        trade_days = len(markets)
+    budget_bytes = budget * 1024 * 1024 - fixed
+    if budget_bytes <= 0:
+        raise ValueError("Budget of {} MB does not cover records and markets".format(budget))
+
+    # Bytes per row of positions: 6 columns of 8 bytes ("Holder" and "ISIN" share one string
+    # object per pair), doubled for the copies made by append in positionsMakeup
+    row_bytes = 2 * 6 * 8
+    # Bytes per trade day of one ISIN: prices and stocks of 8 columns, stocks doubled by append
+    stock_bytes = 3 * 8 * 8
+
+    # Each (Holder, ISIN) pair is made up from its first record to the end date
+    first = records.groupby(["Holder", "ISIN"])["Date"].min()
+    days = (pd.to_datetime(end) - first).dt.days + 1
+    cost = days.groupby(level = "ISIN").sum().sort_index() * row_bytes + trade_days * stock_bytes
+
+    partitions = []
+    partition = []
+    size = 0
+    for isin, n in cost.items():
+        # A single ISIN larger than the budget still makes its own partition
+        if partition and size + n > budget_bytes:
+            partitions.append(partition)
+            partition = []
+            size = 0
+        partition.append(isin)
+        size += n
+    if partition:
+        partitions.append(partition)
+
+    return partitions
+
 def stocksMakeup(prices, markets, initial = False):
     '''
     Make up the stock prices according to market time span.
@@ -0,0 +1,77 @@
+import os
+import sys
+import sqlite3
+import subprocess
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import dataReader as dr
+import dataLogger as dl
+import dataInput as di
+
+@pytest.fixture
+def csvName(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dl.popAudit()
+    holders = ["Alpha Capital"] * 3 + ["alpha capital"] * 2 + ["Bravo Fund"] * 2 + ["Bravo Fnd"] + ["Charlie AG"]
+    pd.DataFrame({"Positionsinhaber": holders,
+                  "Emittent": "Issuer",
+                  "ISIN": ["DE{:03d}".format(i) for i in range(len(holders))],
+                  "Position": ["0,52", "0,6", "71", "0,7", "0,75", "0,8", "0,9", "1,1", "1,2"],
+                  "Datum": ["2015-01-{:02d}".format(i + 1) for i in range(len(holders))]}).to_csv("records.csv", index = False)
+    return "records.csv"
+
+def test_initialClean_audit(csvName):
+    df, df_ref = dr.initialClean(csvName)
+
+    assert sorted(df["Holder"].unique()) == ["Alpha Capital", "Bravo Fund", "Charlie AG"]
+    assert df["Position"].max() < 50
+
+    audit = dl.popAudit()
+    assert audit[["Step", "From_value", "To_value"]].values.tolist() == [
+        ["Position", "71.0", "0.71"],
+        ["Holder_case", "alpha capital", "Alpha Capital"],
+        ["Holder_similar", "Bravo Fnd", "Bravo Fund"]]
+    assert audit.loc[0, "ISIN"] == "DE002"
+
+def test_audit_logs_cleaning_function(csvName):
+    dl.setupLogger("logfile")
+    dr.initialClean(csvName)
+    dl.stopLogger()
+    dl.popAudit()
+
+    with open("logfile") as f:
+        lines = [line for line in f if "correction(s)" in line]
+    assert len(lines) == 3
+    assert all(" initialClean: " in line for line in lines)
+
+def test_setupAudit_on_old_database(csvName):
+    # A database from before the audit table
+    con = sqlite3.connect("ssDB.db")
+    con.execute("CREATE TABLE holders(org_name TEXT NOT NULL);")
+    di.setupAudit(con)
+    di.setupAudit(con)
+
+    dr.initialClean(csvName)
+    dl.popAudit().to_sql(name = "audit", con = con, if_exists = "append", index = False)
+    audit = pd.read_sql_query("SELECT ID_audit, Update_time FROM audit", con = con)
+    con.close()
+
+    assert audit["ID_audit"].tolist() == [1, 2, 3]
+    assert audit["Update_time"].notna().all()
+
+def test_setupLogger_writes_file(tmp_path):
+    dl.setupLogger(str(tmp_path / "logfile"))
+    dl.logger.info("Start Initial Cleaning")
+    dl.stopLogger()
+
+    with open(tmp_path / "logfile") as f:
+        assert "Start Initial Cleaning" in f.read()
+
+def test_import_creates_no_logfile(tmp_path):
+    subprocess.run([sys.executable, "-c", "import dataReader"], cwd = tmp_path, check = True,
+                   env = dict(os.environ, PYTHONPATH = ROOT))
+
+    assert not os.path.exists(tmp_path / "logfile")
@@ -0,0 +1,140 @@
+import os
+import sys
+import sqlite3
+import resource
+import subprocess
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dataReader as dr
+import dataInput as di
+
+START = "2012-01-01"
+END = "2020-12-31"
+# Memory budget of the rebuild in MB
+BUDGET = 16
+
+def synthRecords(n_isin = 40, n_holder = 5, n_record = 5, seed = 0):
+    # Every holder discloses a few positions on every ISIN since 2012
+    rng = np.random.default_rng(seed)
+    n_pair = n_isin * n_holder
+    days = np.concatenate([np.sort(rng.choice(3000, n_record, replace = False)) for _ in range(n_pair)])
+    pair = np.repeat(np.arange(n_pair), n_record)
+    return pd.DataFrame({"Holder": ["Holder {:03d}".format(i % n_holder) for i in pair],
+                         "Issuer": ["Issuer {:04d}".format(i // n_holder) for i in pair],
+                         "ISIN": ["DE{:010d}".format(i // n_holder) for i in pair],
+                         "Position": rng.uniform(0.5, 2, len(pair)).round(2),
+                         "Date": pd.Timestamp(START) + pd.to_timedelta(days, unit = "D")})
+
+def synthClean(n_isin):
+    records = synthRecords(n_isin)
+    holders = pd.DataFrame({"org_name": records["Holder"].unique()})
+    holders["clr_name"] = holders["org_name"]
+    holders["cut_name"] = holders["org_name"].str[0:5]
+    return records, holders
+
+def synthTickers(ISINs):
+    # No ticker is found for the partition of the first ISIN
+    if "DE0000000000" in ISINs:
+        return [None] * len(ISINs), [None] * len(ISINs)
+    return ["T" + isin[-4:] for isin in ISINs], list(ISINs)
+
+def synthPrices(tickers, start, end):
+    if not tickers:
+        return pd.DataFrame(), []
+    date = pd.bdate_range(start, end, name = "Date")
+    prices = pd.concat([pd.DataFrame({"High": 1.0, "Low": 1.0, "Open": 1.0, "Close": 1.0,
+                                      "Volume": 1.0, "Adj_close": 1.0, "Ticker": ticker}, index = date)
+                        for ticker in tickers])
+    return prices, []
+
+def synthMarkets(ticker, source, start, end):
+    markets = synthPrices(["DAX"], start, end)[0].drop(columns = ["Ticker", "Adj_close"])
+    markets["Adj Close"] = 1.0
+    return markets
+
+def mockNetwork(setattr, n_isin):
+    # Records are made up when cleaned, so they count into the memory of the rebuild
+    setattr(dr, "recordsDownloader", lambda start, end: "records.csv")
+    setattr(dr, "initialClean", lambda filename: synthClean(n_isin))
+    setattr(dr, "mapISINtoTicker", synthTickers)
+    setattr(dr, "pricesDownloader", synthPrices)
+    setattr(di.pdr, "DataReader", synthMarkets)
+
+def positionRows(records):
+    first = records.groupby(["Holder", "ISIN"])["Date"].min()
+    return int(((pd.Timestamp(END) - first).dt.days + 1).sum())
+
+@pytest.fixture
+def records(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    mockNetwork(monkeypatch.setattr, 40)
+    return synthRecords()
+
+@pytest.mark.parametrize("sink", ["sqlite", "parquet"])
+def test_peak_rss_under_budget(records, sink, tmp_path):
+    # The whole positions would not fit into the budget
+    rows = positionRows(records)
+    assert rows * 2 * 6 * 8 > 3 * BUDGET * 1024 * 1024
+    assert len(dr.isinPartitions(records, END, BUDGET - di.SINK_BUDGET, synthMarkets("^GDAXI", "yahoo", START, END))) > 3
+
+    # Rebuild in a fresh process, the increase of its peak RSS is the memory of the rebuild
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), sink, str(BUDGET)],
+                            cwd = tmp_path, check = True, capture_output = True, text = True)
+    increase = int(result.stdout.split()[-1])
+    assert increase < BUDGET * 1024 * 1024
+
+    if sink == "sqlite":
+        con = sqlite3.connect("ssDB.db")
+        n = pd.read_sql_query("SELECT COUNT(*) AS n FROM positions", con = con)["n"][0]
+        con.close()
+    else:
+        n = len(pd.read_parquet(os.path.join("ssDB_parquet", "positions")))
+    assert n == rows
+
+def test_parquet_issuers_without_tickers(records):
+    di.partitionedInpute(END, budget = BUDGET, sink = "parquet")
+
+    issuers = pd.read_parquet(os.path.join("ssDB_parquet", "issuers"))
+    assert len(issuers) == records["ISIN"].nunique()
+    assert issuers["Ticker"].isna().sum() > 0
+    assert issuers["Ticker"].notna().sum() > 0
+
+def test_parquet_rerun_drops_stale_parts(records):
+    di.partitionedInpute(END, budget = BUDGET, sink = "parquet")
+    di.partitionedInpute(END, budget = 10 * BUDGET, sink = "parquet")
+
+    positions = pd.read_parquet(os.path.join("ssDB_parquet", "positions"))
+    assert len(positions) == positionRows(records)
+
+def test_unknown_sink_before_download(records, monkeypatch):
+    def fail(start, end):
+        raise AssertionError("downloaded before checking the sink")
+    monkeypatch.setattr(dr, "recordsDownloader", fail)
+
+    with pytest.raises(ValueError):
+        di.partitionedInpute(END, budget = BUDGET, sink = "csv")
+
+if __name__ == "__main__":
+    # Run by test_peak_rss_under_budget: print the increase of peak RSS in bytes
+    sink, budget = sys.argv[1], int(sys.argv[2])
+    import pyarrow.parquet
+
+    # Warm up lazy imports with a small rebuild in another directory
+    os.makedirs("warmup", exist_ok = True)
+    os.chdir("warmup")
+    mockNetwork(setattr, 1)
+    if sink == "sqlite":
+        di.setupDB()
+    di.partitionedInpute(END, budget = budget, sink = sink)
+    os.chdir("..")
+
+    mockNetwork(setattr, 40)
+    if sink == "sqlite":
+        di.setupDB()
+    # ru_maxrss is in KB on Linux
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    di.partitionedInpute(END, budget = budget, sink = sink)
+    print((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) * 1024)